@@ -1 +1 @@
-from .pyconquest import pyconquest
\ No newline at end of file
+from .pyconquest import pyconquest, __version__
\ No newline at end of file
@@ -1,23 +1,49 @@
 import sqlite3
 import logging
 from pydicom import dcmread
+from pydicom.multival import MultiValue
+from pydicom.tag import Tag
+from pydicom.dataelem import RawDataElement
 import os
 import os.path
 import re
 import shutil
-from pynetdicom import AE, evt, AllStoragePresentationContexts, StoragePresentationContexts
-import pkg_resources
+import errno
+import multiprocessing
+import threading
+import collections
+import concurrent.futures
+import functools
+import itertools
+import math
+import mmap
+import queue
 import hashlib
-import pickle
 import time
 import csv
 import sys
+import ctypes
 from logging.handlers import RotatingFileHandler
 
 log = logging.getLogger(__name__)
 LOGFORMAT = "%(levelname)s %(asctime)s [%(filename)-15s:%(lineno)-4s][%(funcName)-30s]\t%(message)s"
 log.setLevel(logging.ERROR)
 
+# the version is looked up once at import, importlib.metadata is much cheaper than importing pkg_resources
+try:
+    from importlib.metadata import version as _distribution_version, PackageNotFoundError
+    try:
+        __version__ = _distribution_version("pyconquest")
+    except PackageNotFoundError:
+        __version__ = 'Unknown'
+except ImportError:
+    # python < 3.8 has no importlib.metadata
+    try:
+        import pkg_resources
+        __version__ = pkg_resources.get_distribution("pyconquest").version
+    except Exception:
+        __version__ = 'Unknown'
+
 ch = logging.StreamHandler(sys.stderr)
 ch.setFormatter(logging.Formatter(LOGFORMAT))
 log.addHandler(ch)
@@ -27,6 +53,209 @@ fh.setFormatter(logging.Formatter(LOGFORMAT))
 fh.setLevel(logging.ERROR)
 log.addHandler(fh)
 
+_WS_RE = re.compile(r"\s+")
+_COLUMN_DELETE_CHARS = str.maketrans('', '', '\t{} ')
+
+
+@functools.lru_cache(maxsize=64)
+def _insert_sql(table, colnames, or_ignore):
+    """Returns the parameterized insert query for the columns, cached so the same query text is reused"""
+    columns_string = ('(' + ','.join(colnames) + ')').replace("-", "_")
+    values_string = '(' + ','.join('?' * len(colnames)) + ')'
+    insert = 'INSERT OR IGNORE' if or_ignore else 'INSERT'
+    return """%s INTO %s %s VALUES %s""" % (insert, table, columns_string, values_string)
+
+
+# tags read for every file, Tag objects skip the conversion pydicom does for a (group, element) tuple
+_TAG_SOP_INSTANCE_UID = Tag(0x0008, 0x0018)
+_TAG_MODALITY = Tag(0x0008, 0x0060)
+_TAG_PATIENT_ID = Tag(0x0010, 0x0020)
+_TAG_STUDY_INSTANCE_UID = Tag(0x0020, 0x000d)
+_TAG_SERIES_INSTANCE_UID = Tag(0x0020, 0x000e)
+
+@functools.lru_cache(maxsize=None)
+def _pynetdicom():
+    """Returns the pynetdicom module, imported on first use. Importing pynetdicom takes a good part of the import time
+    of pyconquest, while many uses only need the database"""
+    import pynetdicom
+    return pynetdicom
+
+
+@functools.lru_cache(maxsize=None)
+def _pynetdicom_sends_files():
+    """From pynetdicom 2.0 send_c_store also accepts the path of the file to send"""
+    return int(_pynetdicom().__version__.split('.')[0]) >= 2
+
+
+# STORE_SEND_CHUNKED_DATASET is a setting of the whole process, it is set by the first of the sends at the same time
+# and restored by the last one
+_streaming_sends_lock = threading.Lock()
+_streaming_sends = 0
+_streaming_setting_before = None
+
+
+def _begin_streaming_files():
+    """Makes pynetdicom stream the sent files from disk, instead of decoding and encoding them again
+
+    :returns: False if this pynetdicom version can not stream files, then _end_streaming_files should not be called"""
+    global _streaming_sends, _streaming_setting_before
+    config = _pynetdicom()._config
+    if not (_pynetdicom_sends_files() and hasattr(config, 'STORE_SEND_CHUNKED_DATASET')):
+        return False
+    with _streaming_sends_lock:
+        if _streaming_sends == 0:
+            _streaming_setting_before = config.STORE_SEND_CHUNKED_DATASET
+            config.STORE_SEND_CHUNKED_DATASET = True
+        _streaming_sends += 1
+    return True
+
+
+def _end_streaming_files():
+    """Restores the STORE_SEND_CHUNKED_DATASET setting when the last send streaming files ends"""
+    global _streaming_sends
+    with _streaming_sends_lock:
+        _streaming_sends -= 1
+        if _streaming_sends == 0:
+            _pynetdicom()._config.STORE_SEND_CHUNKED_DATASET = _streaming_setting_before
+
+
+def _begin_timer_resolution(event=None):
+    """On windows the default timer resolution of 15.6 ms slows down the network loop of pynetdicom a lot, while
+    sending or receiving a resolution of 1 ms is requested. Does nothing on other platforms
+
+    :param: event : the pynetdicom event, when used as event handler"""
+    if sys.platform == 'win32':
+        ctypes.WinDLL('winmm').timeBeginPeriod(1)
+
+
+def _end_timer_resolution(event=None):
+    """Ends the timer resolution requested by _begin_timer_resolution"""
+    if sys.platform == 'win32':
+        ctypes.WinDLL('winmm').timeEndPeriod(1)
+
+
+def _create_directory(path):
+    """Creates the directory and its parents if it does not exist yet, without checking if it exists first
+
+    :returns: True if the directory was created"""
+    try:
+        os.makedirs(path)
+    except FileExistsError:
+        return False
+    return True
+
+
+# errors of os.copy_file_range that mean it can not be used for these files, shutil.copy is used instead
+_COPY_FILE_RANGE_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF,
+                                errno.ETXTBSY, errno.EPERM}
+_COPY_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _fast_copy(src, dst):
+    """Copies the file src to dst (a file or a directory) like shutil.copy. On linux os.copy_file_range copies the
+    data in the kernel, on filesystems like btrfs and xfs this shares the data blocks (reflink) instead of copying
+    them. Otherwise shutil.copy is used, which uses os.sendfile on linux
+
+    :param: src : the file to copy
+    :param: dst : the target file or directory
+    :returns: the target file"""
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    # opening dst for writing would empty src when they are the same file
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError('{!r} and {!r} are the same file'.format(src, dst))
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                copied = 0
+                while True:
+                    count = os.copy_file_range(fsrc.fileno(), fdst.fileno(), _COPY_CHUNK_SIZE)
+                    if not count:
+                        break
+                    copied += count
+                complete = copied == os.fstat(fsrc.fileno()).st_size
+            if complete:
+                shutil.copymode(src, dst)
+                return dst
+        except OSError as e:
+            if e.errno not in _COPY_FILE_RANGE_UNSUPPORTED:
+                raise
+    # a short copy is not trusted, shutil.copy copies the file again
+    return shutil.copy(src, dst)
+
+
+# INSERT ... ON CONFLICT DO UPDATE is supported from sqlite 3.24
+_SQLITE_HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+
+# pydicom reads a file in many small reads, a buffer turns these into a few system calls. It is about the size of
+# a header, a larger buffer would read the pixel data of most images too, which stop_before_pixels skips
+_READ_BUFFER_SIZE = 64 * 1024
+
+
+def _read_dicom_tags(filename, tags_to_read):
+    """Reads the tags_to_read of a dicom file, without the pixel data. Returns None if the file does not have the
+    DICM prefix after the 128 byte preamble, dcmread would reject these files anyway"""
+    with open(filename, 'rb', buffering=_READ_BUFFER_SIZE) as file:
+        file.seek(128)
+        if file.read(4) != b'DICM':
+            return None
+        file.seek(0)
+        return dcmread(file, stop_before_pixels=True, specific_tags=tags_to_read)
+
+
+class _BloomFilter:
+    """Set like filter for the uids of a large table, using about 15 bits per uid instead of a python string. A uid
+    that was added is always found, a uid that was not added is found with a probability of about error_rate"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def __positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        for position in self.__positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(value))
+
+
+# state of the worker processes of rebuild_database_from_dicom, set by _init_rebuild_worker
+_rebuild_worker = None
+
+
+def _init_rebuild_worker(worker, tags_to_read, loglevel):
+    global _rebuild_worker
+    _rebuild_worker = (worker, tags_to_read)
+    log.setLevel(loglevel)
+
+
+def _create_rows_from_file(filenames):
+    """Reads a dicom file in a worker process and returns (filename, (uids, rows), error message), the rows are None
+    if the file is not a dicom file"""
+    full_filename, filename = filenames
+    worker, tags_to_read = _rebuild_worker
+    try:
+        ds = _read_dicom_tags(full_filename, tags_to_read)
+        if ds is None:
+            return filename, None, None
+        uids, rows = worker.create_rows(ds, filename)
+        # the rows are written as strings anyway, and strings are sent back much cheaper than the pydicom value types
+        uids = tuple(map(str, uids))
+        rows = {tablename: {colname: str(value) for colname, value in row.items()} for tablename, row in rows.items()}
+        return filename, (uids, rows), None
+    except Exception as e:
+        return filename, None, 'Error {} in file {}'.format(str(e), full_filename)
+
+
 class pyconquest:
     """Class  ConquestDB is used to read and write (interact) with a conquest PACS database
 
@@ -40,18 +269,59 @@ class pyconquest:
                            'WorkList': 'DICOMworklist'}
     __extra_imagetable_columns = ['ObjectFile', 'ElementCount', 'ElementList', 'Nfractions',
                                   'UniqueFOR_UID', 'ReferencedSeriesUID', 'ReferencedSOPUID','DatabaseTimeStamp', 'hash']
-    __prev_seriesuid = ''
-    __prev_studyuid = ''
-    __prev_patientid = ''
+    __extra_imagetable_columns_set = frozenset(__extra_imagetable_columns)
+    # tags used by write_tags and __extra_dicom_tags on top of the tags in the database definition
+    __extra_tags_to_read = [(0x0008, 0x0018), (0x0008, 0x0060), (0x0010, 0x0020), (0x0020, 0x000d), (0x0020, 0x000e),
+                            (0x3006, 0x0010), (0x3006, 0x0020), (0x3006, 0x0039), (0x300a, 0x0070), (0x300a, 0x00b0),
+                            (0x300c, 0x0002), (0x300c, 0x0060)]
+    # column holding the unique key of every table, used for the existence checks when writing
+    __key_columns = {'DICOMimages': 'SOPInstanc',
+                     'DICOMseries': 'SeriesInst',
+                     'DICOMstudies': 'StudyInsta',
+                     'DICOMpatients': 'PatientID'}
+    __known_uids = None
+    __added_uids = None
+    # tables with more rows get a bloom filter instead of a set of known uids, to limit the memory use
+    __bloom_filter_threshold = 1000000
+    __unique_key_tables = set()
+    __recent_uids_size = 1024
+    __recent_uids_data_version = None
+    # non unique indexes to speed up queries, dropped during a rebuild with check_existing=False
+    # the dicomimages indexes on SeriesInst and ImagePat cover the ObjectFile (and ImagePat) the copy, send and delete
+    # queries select, so these are answered from the index alone
+    __secondary_indexes = {'index_dicomimages_seriesinst_cover': ('DICOMimages',
+                                                                  ('SeriesInst', 'ObjectFile', 'ImagePat')),
+                           'index_dicomimages_imagepat_objectfile': ('DICOMimages', ('ImagePat', 'ObjectFile')),
+                           'index_dicomimages_objectfile': ('DICOMimages', ('ObjectFile',)),
+                           # used by dicom_series_summary to count the series per patient and modality
+                           'index_dicomseries_seriespat_modality': ('DICOMseries', ('SeriesPat', 'Modality'))}
+    # indexes of older versions that are replaced by one of __secondary_indexes
+    __replaced_indexes = ('index_dicomimages_seriesinst',)
     __db_design = {}
+    __db_design_cache = {}
+    __specific_tags = None
+    __insert_templates = {}
+    __summary_cache = {}
+    __batch_timestamp = None
+    __row_buffer = None
+    __timestamp_buffer = None
     __truncate_colnames = True
+    __files_per_commit = 1000
+    __update_timestamp_query = 'update DICOMimages set DatabaseTimeStamp=? where SOPInstanc=?'
+    __copy_workers = 8
+    # older sqlite versions allow at most 999 parameters in a query
+    __max_query_parameters = 500
+    __delete_workers = 32
     __compute_hash = False
     __write_to_database_when_receiving_dicom_data = True
+    __db_lock = threading.Lock()
+    # number of open associations of the listener and when the first of the received rows not yet written arrived
+    __open_associations = 0
+    __received_batch_start = 0.0
+    # the received rows are written at least this often, so they do not stay invisible for long
+    __seconds_per_commit = 5.0
     __instance_creation_time = ''
-    try:
-        __version__ = pkg_resources.get_distribution("pyconquest").version
-    except:
-        __version__ = 'Unknown'
+    __version__ = __version__
     data_directory = ''
     sql_inifile_name = ''
     database_filename = ''
@@ -59,6 +329,8 @@ class pyconquest:
     roi_filter_flags = re.IGNORECASE
     exclude_filter = [r'^Z\d', r'^Ext', 'ISOC', 'QME', 'NP']
     include_filter = ['']
+    __roi_patterns_key = None
+    __roi_patterns = None
 
     def __init__(self, data_directory='data', sql_inifile_name='dicom.sql', database_filename='conquest.db',
                  connect_and_read_sql=True, loglevel='ERROR', compute_hash=False):
@@ -76,6 +348,11 @@ class pyconquest:
         self.database_filename = database_filename
         self.__compute_hash = compute_hash
         self.__instance_creation_time = time.time()
+        self.__forget_recent_uids()
+        # associations kept open by send_dicom_file(keep_association=True)
+        self.__associations = {}
+        # (uids, rows) of the files received by the listener, written when an association ends
+        self.__received_rows = []
 
         if loglevel == 'ERROR':
             log.level = logging.ERROR
@@ -95,82 +372,181 @@ class pyconquest:
     #
 
     def connect_db(self):
-        """Open connection to the sqlite database, database filename defined during instance creation"""
-        self.conn_pacs = sqlite3.connect(self.database_filename)
+        """Open connection to the sqlite database, database filename defined during instance creation
+
+        The database is opened in autocommit mode and, for file based databases, switched to WAL journaling so
+        readers (for instance a second instance next to a running dicom listener) do not block the writer.
+        """
+        self.conn_pacs = sqlite3.connect(self.database_filename, isolation_level=None, check_same_thread=False)
+        # serializes the use of this connection by the threads of the dicom listener, other instances have their own
+        # connection and lock
+        self.__db_lock = threading.Lock()
+        self.__insert_templates = {}
+        self.__summary_cache = {}
+        # data_version is per connection, the recent uids are checked again on the new connection
+        self.__recent_uids_data_version = None
+        if self.database_filename != ':memory:':
+            self.conn_pacs.execute('PRAGMA journal_mode=WAL')
+            self.conn_pacs.execute('PRAGMA synchronous=NORMAL')
+            self.conn_pacs.execute('PRAGMA wal_autocheckpoint=1000')
+        self.conn_pacs.execute('PRAGMA temp_store=MEMORY')
+        self.conn_pacs.execute('PRAGMA cache_size=-65536')
+        self.conn_pacs.execute('PRAGMA mmap_size=268435456')
         log.info('Connected to ' + self.database_filename)
         # if the database is new, so empty recreate the tables this can save a step and is logical
         result = self.execute_db_query("SELECT name FROM sqlite_master WHERE type='table' AND lower(name)='dicomseries' ")
         if not result:
             log.info('Creating tables because sqlite database is empty')
             self.create_standard_dicom_tables()
+        else:
+            # older databases were created without unique indexes on the keys
+            self.__create_db_index_tables()
 
     def close_db(self):
-        """Close connection to the sqlite database"""
+        """Close connection to the sqlite database, the associations kept open by send_dicom are released too and the
+        rows of files received by the listener that are not written yet are written"""
+        self.close_associations()
+        with self.__db_lock:
+            self.__write_received_rows()
         self.conn_pacs.close()
         log.info('Closed connection to ' + self.database_filename)
         timediff = time.time() - self.__instance_creation_time
         log.info('Time elapsed : {:.1f} seconds ({:.2f} min)'.format(float(timediff), float(timediff/60.0)))
 
-    def execute_db_query(self, query, return_list_from_col=None):
+    def checkpoint(self):
+        """Copy the content of the WAL file back into the database file, handy after importing large batches"""
+        self.conn_pacs.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        log.info('Checkpointed WAL of ' + self.database_filename)
+
+    def begin_batch(self):
+        """Starts a transaction, the writes that follow are committed together by commit_batch(). Outside a batch
+        every statement is committed on its own"""
+        if not self.conn_pacs.in_transaction:
+            self.conn_pacs.execute('BEGIN IMMEDIATE')
+
+    def commit_batch(self):
+        """Commits the transaction started by begin_batch()"""
+        if self.conn_pacs.in_transaction:
+            self.conn_pacs.execute('COMMIT')
+
+    def rollback_batch(self):
+        """Discards the writes since begin_batch()"""
+        # the recently written uids may be rolled back too
+        self.__forget_recent_uids()
+        if self.conn_pacs.in_transaction:
+            self.conn_pacs.execute('ROLLBACK')
+
+    def execute_db_query(self, query, return_list_from_col=None, params=None):
         """Executes sqlite query on the opened database, and returns the result
 
         :param: query : query to be exceuted on the sqlite database
         :param: return_list_form_co : when set a list is returned of this columnname
+        :param: params : values for the ? placeholders in the query, DEFAULT : None
         :returns: query result in the form of al list of dicts
         """
         query_result = None
         try:
             cursor = self.conn_pacs.cursor()
-            cursor.execute(query)
-            self.conn_pacs.commit()
-            data = cursor.fetchall()
-            cols = cursor.description
-            query_result = [dict(line) for line in [zip([column[0] for column in cols], row) for row in data]]
-            log.debug('Query : '+query)
-            log.debug('Result: ' + str(query_result))
+            if params is None:
+                cursor.execute(query)
+            else:
+                cursor.execute(query, params)
+            if cursor.description is None:
+                # statements like INSERT/UPDATE/CREATE have no result rows
+                query_result = []
+            elif return_list_from_col is None:
+                colnames = [column[0] for column in cursor.description]
+                query_result = [dict(zip(colnames, row)) for row in cursor]
+            else:
+                # only the values of one column are returned, so no dict is built per row
+                colnames = [column[0] for column in cursor.description]
+                if return_list_from_col not in colnames:
+                    raise KeyError(return_list_from_col)
+                index = colnames.index(return_list_from_col)
+                query_result = [row[index] for row in cursor]
+            if log.isEnabledFor(logging.DEBUG):
+                # formatting a large result is expensive, so only done when it is logged
+                log.debug('Query : {} ; params : {}'.format(query, params))
+                log.debug('Result: ' + str(query_result))
         except Exception as e:
             log.error('exception ' + str(e) + '\nencountered in execution of db query: ' + query)
 
-        if return_list_from_col is None:
-            return query_result
-        else:
-            result = [row[return_list_from_col] for row in query_result]
-            return result
+        return query_result
+
+    def execute_db_query_iter(self, query, params=None):
+        """Executes sqlite query on the opened database and yields the result rows as tuples, without building the
+        whole result first. Use this for large results of which only a few columns are needed
+
+        :param: query : query to be exceuted on the sqlite database
+        :param: params : values for the ? placeholders in the query, DEFAULT : None
+        :returns: generator of tuples with the values of the columns in the order of the query
+        """
+        try:
+            if params is None:
+                cursor = self.conn_pacs.execute(query)
+            else:
+                cursor = self.conn_pacs.execute(query, params)
+        except Exception as e:
+            log.error('exception ' + str(e) + '\nencountered in execution of db query: ' + query)
+            return
+        yield from cursor
 
     def insert_dict(self, tablename, datadict, exceptions={}, default_format='character varying(128)'):
         """
         Inserts a dict and creates a table if it not exists
 
         :param: tablename: name of table to store dict in
-        :param: datadict: dict to store
+        :param: datadict: dict to store, or a list of dicts; the dicts with the same keys are inserted with one
+            executemany and all dicts are committed together
         :return: nothing
         """
-        query = self.create_insertquery(tablename, datadict)
+        datadicts = [datadict] if isinstance(datadict, dict) else list(datadict)
+        if not datadicts:
+            return
+        # the dicts with the same keys share the insert query
+        params_per_query = {}
+        for row in datadicts:
+            query, params = self.create_insertquery(tablename, row)
+            params_per_query.setdefault(query, []).append(params)
+
+        own_batch = not self.conn_pacs.in_transaction
+        if own_batch:
+            self.begin_batch()
         try:
-            cursor = self.conn_pacs.cursor()
-            cursor.execute(query)
-            self.conn_pacs.commit()
-        except Exception as e:
-            if str(e).startswith('no such table') == True:
-                log.info("Now creating table : {} to insert dict in".format(tablename))
-                buildquery = self.create_buildquery(tablename, datadict,
-                                                    exceptions=exceptions, default_format=default_format)
-                cursor = self.conn_pacs.cursor()
-                cursor.execute(buildquery)
-                self.conn_pacs.commit()
-                # now write anyway
-                cursor = self.conn_pacs.cursor()
-                cursor.execute(query)
-                self.conn_pacs.commit()
-            else:  # something else is wrong
-                log.error("Error {} when inserting dict {} into table {}".format(str(e), datadict, tablename))
+            try:
+                self.__insert_params(params_per_query)
+            except Exception as e:
+                if str(e).startswith('no such table') == True:
+                    log.info("Now creating table : {} to insert dict in".format(tablename))
+                    # the table gets the columns of all dicts, in the order they first appear
+                    columns = dict.fromkeys(key for row in datadicts for key in row)
+                    buildquery = self.create_buildquery(tablename, columns,
+                                                        exceptions=exceptions, default_format=default_format)
+                    cursor = self.conn_pacs.cursor()
+                    cursor.execute(buildquery)
+                    # now write anyway
+                    self.__insert_params(params_per_query)
+                else:  # something else is wrong
+                    log.error("Error {} when inserting dict {} into table {}".format(str(e), datadict, tablename))
+                    if own_batch:
+                        self.rollback_batch()
+                    return
+        except Exception:
+            if own_batch:
+                self.rollback_batch()
+            raise
+        if own_batch:
+            self.commit_batch()
+
+    def __insert_params(self, params_per_query):
+        for query, params_list in params_per_query.items():
+            self.conn_pacs.executemany(query, params_list)
 
     def __delete_table(self, tablename):
         """"Delete table with given name"""
         try:
             cur = self.conn_pacs.cursor()
             cur.execute('DROP TABLE IF EXISTS ' + tablename)
-            self.conn_pacs.commit()
         except Exception as e:
             log.error('failed to drop table : ' + tablename )
 
@@ -183,27 +559,21 @@ class pyconquest:
 
         :returns: True or False depending on whether the row already exists"""
 
-        cur = self.conn_pacs.cursor()
-        query = 'SELECT * FROM ' + tablename + ' WHERE ' + colname + ' = \"' + value.strip() + '\"'
-        cur.execute(query)
-        row = cur.fetchone()
-        if row is None:
-            return False
-        else:
-            return True
+        query = 'SELECT 1 FROM {} WHERE {} = ? LIMIT 1'.format(tablename, colname)
+        row = self.conn_pacs.execute(query, (str(value).strip(),)).fetchone()
+        return row is not None
 
-    def create_insertquery(self, table, myDict):
-        """Returns string with the format of an insertquery for sqlite to insert given dict in table called : table
+    def create_insertquery(self, table, myDict, or_ignore=False):
+        """Returns a parameterized insertquery for sqlite to insert given dict in table called : table
 
         :param: table : name of the table to insert into
         :param: myDict : a Dict with columname/value pairs to enter into the insertquery
-        :returns: string formatted as an insert query"""
+        :param: or_ignore : if True an INSERT OR IGNORE query is returned, so rows violating a unique index are skipped
+        :returns: tuple (query, params), the query has a ? placeholder for every value in params"""
 
         myDict = self.__convert_listvalues_to_conquest_style(myDict)
-        columns_string = ('(' + ','.join(myDict.keys()) + ')').replace("-", "_")
-        values_string = ('("' + '","'.join(map(str, myDict.values())) + '")').replace("\'", " ")
-        sql = """INSERT INTO %s %s VALUES %s""" % (table, columns_string, values_string)
-        return sql
+        sql = _insert_sql(table, tuple(myDict.keys()), or_ignore)
+        return sql, tuple(map(str, myDict.values()))
 
     def create_buildquery(self, table, mydict, exceptions={}, default_format='character varying(128)'):
         """Returns string with the format of an buildquery for sqlite to create a table with colnames as given
@@ -233,10 +603,10 @@ class pyconquest:
     def __convert_listvalues_to_conquest_style(self, Dict):
         """Scans all items in a dict, and converts a list value to a string formatted as el1\\el2\\el3 etc.
         ; this conforms to the original conquest style"""
+        extra_columns = self.__extra_imagetable_columns_set
         for key, val in Dict.items():
-            if str(val).startswith("[") is True and key not in self.__extra_imagetable_columns:
-                val = str(val).replace('[', '').replace(']', '').replace(',', "\\")
-                Dict[key] = val
+            if isinstance(val, (list, MultiValue)) and key not in extra_columns:
+                Dict[key] = "\\".join(map(str, val))
         return Dict
 
     def add_column_to_database(self, tablename, column_definition):
@@ -250,22 +620,39 @@ class pyconquest:
 
         for col in column_definition:
             try:
-                self.__db_design[tablename].append(col)
+                self.__db_design[tablename].append(self.__resolve_column(col))
+                self.__specific_tags = None
+                self.__insert_templates = {}
                 log.info('Added column {} to table {}'.format(col, tablename))
             except Exception:
                 log.error('failed to add column {} to table {}'.format(col, tablename))
 
+    def __resolve_column(self, col):
+        """Converts a column definition like ['0x0020', '0x000e', 'SeriesInst'] into (Tag(0x0020, 0x000e), 'SeriesInst'),
+        so the hex strings are parsed only once"""
+        return Tag(int(col[0], 16), int(col[1], 16)), col[2].replace('\"', '')
+
     def __read_conquest_sql_inifile(self, filename):
-        """reads in the conquest style .sql file where the db is defined, follows original file format"""
-        if os.path.exists(filename):
-            with open(filename) as file:
-                lines = file.readlines()
-                lines = [line.rstrip() for line in lines]
-            file.close()
-        else:
+        """reads in the conquest style .sql file where the db is defined, follows original file format. The parsed
+        file is cached on the class, so new instances using the same unchanged file do not parse it again"""
+        try:
+            modification_time = os.path.getmtime(filename)
+        except OSError:
             self.__set_default_database()
             return
 
+        key = (filename, modification_time, self.__truncate_colnames)
+        if key in pyconquest.__db_design_cache:
+            # copy the lists, add_column_to_database() appends to them
+            self.__db_design = {table: list(rows) for table, rows in pyconquest.__db_design_cache[key].items()}
+            self.__specific_tags = None
+            return
+
+        with open(filename) as file:
+            lines = [line.rstrip() for line in file.read().splitlines()]
+
+        self.__db_design = {}
+        self.__specific_tags = None
         for line in lines:
             # comment lines
             if line.startswith("#") or line.startswith("/*") or line.startswith("*/"):
@@ -283,22 +670,81 @@ class pyconquest:
                 self.__db_design[tablename] = list_of_rows
                 continue
 
-            stripped_line = re.sub("\s+", ' ', line)
+            stripped_line = _WS_RE.sub(' ', line)
             if stripped_line.startswith(" {"):
-                col = (line.replace("\t{", "").replace("}", "").replace("{", '').replace(" ", "").split(","))
+                col = line.translate(_COLUMN_DELETE_CHARS).split(",")
                 if self.__truncate_colnames:
                     col[2] = col[2].replace('"', '').replace(' ', '')[0:10]
-                list_of_rows.append(col[0:3])
+                list_of_rows.append(self.__resolve_column(col))
+
+        pyconquest.__db_design_cache[key] = {table: list(rows) for table, rows in self.__db_design.items()}
+
+    def __tags_to_read(self):
+        """Returns the list of tags needed to fill the database, to pass as specific_tags to dcmread"""
+        if self.__specific_tags is None:
+            tags = set(self.__extra_tags_to_read)
+            for tablelist in self.__db_design.values():
+                for tag, colname in tablelist:
+                    tags.add(tag)
+            self.__specific_tags = list(tags)
+        return self.__specific_tags
+
+    def __load_known_uids(self):
+        """Reads the keys of all rows in the tables into sets, so existence checks are done in memory"""
+        self.__known_uids = {}
+        self.__added_uids = {}
+        for tablename, colname in self.__key_columns.items():
+            row_count = self.conn_pacs.execute('SELECT count(*) FROM {}'.format(tablename)).fetchone()[0]
+            cur = self.conn_pacs.execute('SELECT {} FROM {}'.format(colname, tablename))
+            if row_count > self.__bloom_filter_threshold:
+                known = _BloomFilter(row_count)
+                for row in cur:
+                    known.add(str(row[0]))
+                log.info('Loaded {} known uids of {} in a bloom filter'.format(row_count, tablename))
+            else:
+                known = {row[0] for row in cur}
+                log.info('Loaded {} known uids of {}'.format(row_count, tablename))
+            self.__known_uids[tablename] = known
+            # the uids written while the known uids are loaded, the bloom filter is not extended
+            self.__added_uids[tablename] = set()
+
+    def __row_exists(self, tablename, value):
+        """Check if the table already contains a row with this key, using the known uids when loaded. When the table
+        has a unique index on the key, False is returned and the INSERT OR IGNORE query takes care of existing rows"""
+        if self.__known_uids is not None:
+            value = str(value)
+            known = self.__known_uids[tablename]
+            if value in self.__added_uids[tablename]:
+                return True
+            if value not in known:
+                return False
+            if isinstance(known, _BloomFilter):
+                # the bloom filter can give a false positive, the database has the answer
+                return self.__check_if_table_contains(tablename, self.__key_columns[tablename], value)
+            return True
+        if tablename in self.__unique_key_tables:
+            return False
+        return self.__check_if_table_contains(tablename, self.__key_columns[tablename], value)
+
+    def __add_known_uid(self, tablename, value):
+        if self.__known_uids is not None:
+            self.__added_uids[tablename].add(str(value))
 
     def __create_tabledict(self, tablename, ds):
+        """Returns the row for tablename with the values of the tags of the database definition, the columns are
+        resolved to (tag, colname) when the definition is read"""
         tabledict = {}
-        for item in self.__db_design[tablename]:
+        get_element = ds.get
+        for tag, colname in self.__db_design[tablename]:
             try:
-                elem = ds[item[0], item[1]]
-                val = elem.value
+                elem = get_element(tag)
+                val = '' if elem is None else elem.value
             except Exception:
                 val = ''
-            tabledict[item[2].replace('\"', '')] = val
+            # multi valued tags are stored conquest style as el1\el2\el3
+            if isinstance(val, MultiValue):
+                val = "\\".join(map(str, val))
+            tabledict[colname] = val
         return tabledict
 
     def write_tags(self, ds, filename='', check_existing=True):
@@ -311,61 +757,230 @@ class pyconquest:
         :param: filename : the filename of the file that was read (to insert into the DICOMimages.ObjectFile column)
         :param: check_existing : if True, a check is done before inserting the row into the table, default TRUE
         """
-        sopinstanceuid = ds['0x0008', '0x0018'].value
+        # the rows of the file are committed together, unless the caller has started a batch
+        own_batch = not self.conn_pacs.in_transaction
+        if own_batch:
+            self.begin_batch()
+        try:
+            self.__write_rows(self.__get_uids(ds), {}, ds, filename, check_existing=check_existing)
+        except Exception:
+            if own_batch:
+                self.rollback_batch()
+            raise
+        if own_batch:
+            self.commit_batch()
+
+    def create_rows(self, ds, filename=''):
+        """Returns the rows write_tags would insert for the given dicom tags, without touching the database
+
+        :param: ds : the dicom tags from the file, in the pydicom format
+        :param: filename : the filename of the file that was read (to insert into the DICOMimages.ObjectFile column)
+        :returns: tuple (uids, rows), uids are the (sopinstanceuid, seriesuid, studyuid, patientid) of the file and
+            rows is a dict with the row (dict with columname/value pairs) of each table
+        """
+        rows = {}
+        for tablename in ['DICOMimages', 'DICOMseries', 'DICOMstudies', 'DICOMpatients']:
+            self.__get_row(rows, tablename, ds, filename)
+        return self.__get_uids(ds), rows
+
+    def __timestamp(self):
+        """Returns the DatabaseTimeStamp for a written row, during a rebuild this is the time the batch started"""
+        if self.__batch_timestamp is None:
+            return time.time()
+        return self.__batch_timestamp
+
+    def __get_uids(self, ds):
+        return (ds[_TAG_SOP_INSTANCE_UID].value, ds[_TAG_SERIES_INSTANCE_UID].value, ds[_TAG_STUDY_INSTANCE_UID].value,
+                ds[_TAG_PATIENT_ID].value)
+
+    def __get_row(self, rows, tablename, ds, filename):
+        """Returns the row for tablename from rows, the row is created from ds if it is not there yet"""
+        if tablename not in rows:
+            row = self.__create_tabledict(tablename, ds)
+            if tablename == 'DICOMimages':
+                row['ObjectFile'] = filename
+                row.update(self.__extra_dicom_tags(ds, filename))
+            elif tablename == 'DICOMseries' and 'DICOMimages' in rows:
+                imagedict = rows['DICOMimages']
+                # if a unique FOR_UID was extracted from RTSTRUCT, add to series table also
+                if 'UniqueFOR_UID' in imagedict:
+                    row['FrameOfRef'] = imagedict['UniqueFOR_UID']
+                if 'ReferencedSeriesUID' in imagedict:
+                    row['Referenced'] = imagedict['ReferencedSeriesUID']
+            rows[tablename] = row
+        return rows[tablename]
+
+    def __write_rows(self, uids, rows, ds=None, filename='', check_existing=True):
+        """Inserts the rows of a single dicom file in the tables, rows that are not in rows are created from ds but
+        only for the tables where the row does not exist yet
+
+        :param: uids : tuple (sopinstanceuid, seriesuid, studyuid, patientid) of the file
+        :param: rows : dict with the already created rows per table
+        """
+        sopinstanceuid, seriesuid, studyuid, patientid = uids
 
         if check_existing:
-            row_exists = self.__check_if_table_contains('DICOMimages', 'SOPInstanc', sopinstanceuid)
+            row_exists = self.__row_exists('DICOMimages', sopinstanceuid)
         else:
             row_exists = False
 
+        timestamp_updated = False
+        if not row_exists and check_existing and self.__row_buffer is None and \
+                'DICOMimages' in self.__unique_key_tables:
+            # with the unique index __row_exists can not tell, updating the timestamp first does. The row (with the
+            # extra tags and the hash) is only created for a new image
+            row_exists = timestamp_updated = self.__update_timestamp(sopinstanceuid)
+
         if not row_exists:
-            imagedict = self.__create_tabledict('DICOMimages', ds)
-            imagedict['ObjectFile'] = filename
-            imagedict.update(self.__extra_dicom_tags(ds, filename))
-            query = self.create_insertquery('DICOMimages', imagedict)
-            self.execute_db_query(query)
-        else:
+            imagedict = self.__get_row(rows, 'DICOMimages', ds, filename)
+            if self.__row_buffer is None and check_existing and self.__upsert_template('DICOMimages') is not None:
+                # one statement inserts the row or updates the timestamp of the row that was already there
+                self.__insert_row('DICOMimages', imagedict, upsert=True)
+            elif self.__row_buffer is None:
+                changes_before_insert = self.conn_pacs.total_changes
+                self.__insert_row('DICOMimages', imagedict)
+                # nothing inserted means the row was already there
+                row_exists = check_existing and self.conn_pacs.total_changes == changes_before_insert
+            else:
+                # while buffering the known uids have already told if the row exists
+                self.__insert_row('DICOMimages', imagedict)
+            self.__add_known_uid('DICOMimages', sopinstanceuid)
+
+        if row_exists and not timestamp_updated:
             # update timestamp in case of rewrite of the data
-            updatequery = """update DICOMimages set DatabaseTimeStamp=\'{}\' where SOPInstanc=\'{}\'""". \
-                format(time.time(), sopinstanceuid)
-            self.execute_db_query(updatequery)
-
-        seriesuid = ds['0x0020', '0x000e'].value
-        if not (seriesuid == self.__prev_seriesuid):
-            self.__prev_seriesuid = seriesuid
-            if not self.__check_if_table_contains('DICOMseries', 'SeriesInst', seriesuid):
-                seriesdict = self.__create_tabledict('DICOMseries', ds)
-                # if a unique FOR_UID was extracted from RTSTRUCT, add to series table also
-                if 'UniqueFOR_UID' in imagedict:
-                    seriesdict['FrameOfRef'] = imagedict['UniqueFOR_UID']
-                if 'ReferencedSeriesUID' in imagedict:
-                    seriesdict['Referenced'] = imagedict['ReferencedSeriesUID']
-                query = self.create_insertquery('DICOMseries', seriesdict)
-                self.execute_db_query(query)
-
-            studyuid = ds['0x0020', '0x000d'].value
-            if not (studyuid == self.__prev_studyuid):
-                self.__prev_studyuid = studyuid
-                if not self.__check_if_table_contains('DICOMstudies', 'Studyinsta', studyuid):
-                    studydict = self.__create_tabledict('DICOMstudies', ds)
-                    query = self.create_insertquery('DICOMstudies', studydict)
-                    self.execute_db_query(query)
-
-                patientid = ds['0x0010', '0x0020'].value
-                if not (patientid == self.__prev_patientid):
-                    self.__prev_patientid = patientid
-                    if not self.__check_if_table_contains('DICOMpatients', 'Patientid', patientid):
-                        patientdict = self.__create_tabledict('DICOMpatients', ds)
-                        query = self.create_insertquery('DICOMpatients', patientdict)
-                        self.execute_db_query(query)
+            params = (str(self.__timestamp()), sopinstanceuid)
+            if self.__row_buffer is None:
+                self.execute_db_query(self.__update_timestamp_query, params=params)
+            else:
+                self.__timestamp_buffer.append(params)
+
+        self.__check_recent_uids()
+        if not self.__is_recent_uid('DICOMseries', seriesuid):
+            if not self.__row_exists('DICOMseries', seriesuid):
+                seriesdict = self.__get_row(rows, 'DICOMseries', ds, filename)
+                self.__insert_row('DICOMseries', seriesdict)
+                self.__add_known_uid('DICOMseries', seriesuid)
+
+            if not self.__is_recent_uid('DICOMstudies', studyuid):
+                if not self.__row_exists('DICOMstudies', studyuid):
+                    studydict = self.__get_row(rows, 'DICOMstudies', ds, filename)
+                    self.__insert_row('DICOMstudies', studydict)
+                    self.__add_known_uid('DICOMstudies', studyuid)
+
+                if not self.__is_recent_uid('DICOMpatients', patientid):
+                    if not self.__row_exists('DICOMpatients', patientid):
+                        patientdict = self.__get_row(rows, 'DICOMpatients', ds, filename)
+                        self.__insert_row('DICOMpatients', patientdict)
+                        self.__add_known_uid('DICOMpatients', patientid)
+
+    def __update_timestamp(self, sopinstanceuid):
+        """Updates the DatabaseTimeStamp of the DICOMimages row of sopinstanceuid
+
+        :returns: True if the row exists"""
+        try:
+            cursor = self.conn_pacs.execute(self.__update_timestamp_query, (str(self.__timestamp()), sopinstanceuid))
+        except Exception as e:
+            log.error('exception ' + str(e) + '\nencountered in execution of db query: ' + self.__update_timestamp_query)
+            return False
+        return cursor.rowcount > 0
+
+    def __insert_template(self, tablename):
+        """Returns (query, colnames) to insert a row in tablename, colnames are the columns of the database
+        definition that exist in the table. Built once per table and cached"""
+        if tablename not in self.__insert_templates:
+            table_info = self.conn_pacs.execute('PRAGMA table_info("{}")'.format(tablename))
+            table_columns = {info[1].lower() for info in table_info}
+            colnames = [colname for tag, colname in self.__db_design[tablename]]
+            if tablename == 'DICOMimages':
+                colnames += self.__extra_imagetable_columns
+            colnames = tuple(colname for colname in dict.fromkeys(colnames)
+                             if colname.replace("-", "_").lower() in table_columns)
+            query = 'INSERT OR IGNORE INTO {} ({}) VALUES ({})'.format(
+                tablename, ','.join(colnames).replace("-", "_"), ','.join('?' * len(colnames)))
+            self.__insert_templates[tablename] = query, colnames
+        return self.__insert_templates[tablename]
+
+    def __upsert_template(self, tablename):
+        """Returns (query, colnames) to insert a row in tablename or, when the key is already there, to only update
+        the DatabaseTimeStamp of that row. None when sqlite is older than 3.24 (no upsert) or the table has no unique
+        index on the key"""
+        key = (tablename, 'upsert')
+        if key not in self.__insert_templates:
+            query, colnames = self.__insert_template(tablename)
+            if _SQLITE_HAS_UPSERT and tablename in self.__unique_key_tables and 'DatabaseTimeStamp' in colnames:
+                query = query.replace('INSERT OR IGNORE', 'INSERT', 1) + \
+                    ' ON CONFLICT({}) DO UPDATE SET DatabaseTimeStamp=excluded.DatabaseTimeStamp'.format(
+                        self.__key_columns[tablename])
+                self.__insert_templates[key] = query, colnames
+            else:
+                self.__insert_templates[key] = None
+        return self.__insert_templates[key]
+
+    def __insert_row(self, tablename, row, upsert=False):
+        """Inserts a row created by __get_row, columns missing in the row are left NULL. While rows are buffered
+        the row is only added to the buffer, __flush_rows writes it. With upsert=True the __upsert_template is used"""
+        if upsert:
+            query, colnames = self.__upsert_template(tablename)
+        else:
+            query, colnames = self.__insert_template(tablename)
+        # a list comprehension is faster than a generator expression here
+        params = tuple([str(row[colname]) if colname in row else None for colname in colnames])
+        if self.__row_buffer is None:
+            self.execute_db_query(query, params=params)
+        else:
+            self.__row_buffer[tablename].append(params)
+
+    def __flush_rows(self):
+        """Writes the buffered rows and timestamp updates with one executemany per table"""
+        for tablename, buffered_rows in self.__row_buffer.items():
+            if buffered_rows:
+                query, colnames = self.__insert_template(tablename)
+                self.__execute_many(query, buffered_rows)
+                buffered_rows.clear()
+        if self.__timestamp_buffer:
+            self.__execute_many(self.__update_timestamp_query, self.__timestamp_buffer)
+            self.__timestamp_buffer.clear()
+
+    def __execute_many(self, query, params_list):
+        try:
+            self.conn_pacs.executemany(query, params_list)
+        except Exception as e:
+            log.error('exception ' + str(e) + '\nencountered in execution of db query: ' + query)
+
+    def __is_recent_uid(self, tablename, uid):
+        """Returns True if this instance recently wrote the row of uid in tablename, otherwise the uid is remembered.
+        Keeps the last __recent_uids_size uids per table, so files arriving interleaved by series still hit"""
+        recent = self.__recent_uids[tablename]
+        if uid in recent:
+            recent.move_to_end(uid)
+            return True
+        recent[uid] = None
+        if len(recent) > self.__recent_uids_size:
+            recent.popitem(last=False)
+        return False
+
+    def __forget_recent_uids(self):
+        """Clears the recently written uids, needed when rows are deleted or not committed"""
+        self.__recent_uids = {tablename: collections.OrderedDict()
+                              for tablename in ['DICOMseries', 'DICOMstudies', 'DICOMpatients']}
+
+    def __check_recent_uids(self):
+        """Clears the recently written uids when another connection committed changes (data_version changed), it
+        may have deleted their rows"""
+        data_version = self.conn_pacs.execute('PRAGMA data_version').fetchone()[0]
+        if data_version != self.__recent_uids_data_version:
+            self.__forget_recent_uids()
+            self.__recent_uids_data_version = data_version
 
     def create_standard_dicom_tables(self):
         """Destroys (if necessary) and recreates empty tables according to the database definition of this instance"""
+        self.__forget_recent_uids()
+        self.__insert_templates = {}
         for tablename in self.__db_design:
             tablelist = self.__db_design[tablename]
             colnames = {}
             for item in tablelist:
-                colnames[item[2]] = 'dummy'
+                colnames[item[1]] = 'dummy'
 
             # as an excepion, add extra column to images table
             if tablename == 'DICOMimages':
@@ -379,14 +994,17 @@ class pyconquest:
         self.__create_db_views()
         self.__create_db_index_tables()
 
-    def rebuild_database_from_dicom(self, mrn=None, compute_only_missing=True, check_existing=True):
+    def rebuild_database_from_dicom(self, mrn=None, compute_only_missing=True, check_existing=True, processes=1):
         """Rebuild the sqlite database by scanning the dicom data directory
 
         :param: mrn : if given, only the data from that directory / patient MRN is put in the database
         :param: ComputeOnlyMissing : if True a directory/MRN is only processed if there is NO entry in the database
-         with that number default : True
+         with that number, and files already in the database are skipped unless they were modified after they were
+         written to the database default : True
         :param: check_existing : if True, a check is done when inserting rows in the db. put to False to speed up
-            initial database rebuilding
+            initial database rebuilding, the non unique indexes are then dropped during the rebuild and recreated after
+        :param: processes : number of processes used to read the dicom files, None uses all cpu's. When using more
+            than 1 process on Windows/macOS, call this from within an if __name__ == '__main__': block, DEFAULT : 1
         :returns: number of scanned files
          """
         if mrn is None:
@@ -394,29 +1012,144 @@ class pyconquest:
         else:
             directory = '{}/{}'.format(self.data_directory,mrn)
 
-        already_present = self.execute_db_query(query='select PatientID from dicompatients',
-                                              return_list_from_col='PatientID')
+        if compute_only_missing:
+            already_present = set(self.execute_db_query(query='select PatientID from dicompatients',
+                                                        return_list_from_col='PatientID'))
+            known_files = dict(self.execute_db_query_iter('select ObjectFile, DatabaseTimeStamp from dicomimages'))
+        else:
+            already_present = set()
+            known_files = {}
+        files = self.__files_to_rebuild(directory, already_present, known_files)
         counter = 0
-        string_startingpoint = len(self.data_directory) + 1
-        for root, dirs, files in os.walk(directory, topdown=True):
-            mrn = root[len(self.data_directory)+1:]
-            if (mrn in already_present) and (compute_only_missing is True):
-                log.info('Skipping Directory, PatientID already in database: '+str(mrn))
-                continue
-
-            for name in files:
-                full_filename = os.path.join(root, name)
-                log.info('Processing ... ' + full_filename)
-                try:
+        tags_to_read = self.__tags_to_read()
+        self.__load_known_uids()
+        if not check_existing:
+            # inserting is faster without maintaining the query indexes, they are built once at the end
+            self.__drop_secondary_indexes()
+        # all files are written in one transaction, committed every __files_per_commit files unless the caller has
+        # started a batch. The rows are buffered and written per batch with executemany
+        self.__row_buffer = collections.defaultdict(list)
+        self.__timestamp_buffer = []
+        own_batch = not self.conn_pacs.in_transaction
+        if own_batch:
+            self.begin_batch()
+        # all rows of a batch get the same DatabaseTimeStamp
+        self.__batch_timestamp = time.time()
+        try:
+            if processes == 1:
+                for full_filename, filename in files:
+                    log.info('Processing ... ' + full_filename)
                     counter = counter + 1
-                    ds = dcmread(full_filename)
-                    self.write_tags(ds, full_filename[string_startingpoint:], check_existing=check_existing)
-                except Exception as e:
-                    log.error(str(e))
+                    try:
+                        ds = _read_dicom_tags(full_filename, tags_to_read)
+                        if ds is None:
+                            log.info('Skipping non dicom file ' + full_filename)
+                        else:
+                            self.write_tags(ds, filename, check_existing=check_existing)
+                    except Exception as e:
+                        log.error(str(e))
+
+                    if counter % self.__files_per_commit == 0:
+                        self.__next_rebuild_batch(own_batch)
+            else:
+                # the worker processes read the files and create the rows, the database is only written from here
+                worker = pyconquest(data_directory=self.data_directory, connect_and_read_sql=False,
+                                    loglevel=logging.getLevelName(log.level), compute_hash=self.__compute_hash)
+                worker.__db_design = self.__db_design
+                with multiprocessing.Pool(processes, initializer=_init_rebuild_worker,
+                                          initargs=(worker, tags_to_read, log.level)) as pool:
+                    for filename, result, error in pool.imap_unordered(_create_rows_from_file, files, chunksize=64):
+                        log.info('Processed ... ' + filename)
+                        counter = counter + 1
+                        if error is not None:
+                            log.error(error)
+                        elif result is None:
+                            log.info('Skipped non dicom file ' + filename)
+                        else:
+                            uids, rows = result
+                            self.__write_rows(uids, rows, check_existing=check_existing)
+
+                        if counter % self.__files_per_commit == 0:
+                            self.__next_rebuild_batch(own_batch)
+            self.__flush_rows()
+        except Exception:
+            if own_batch:
+                self.rollback_batch()
+            raise
+        finally:
+            self.__known_uids = None
+            self.__added_uids = None
+            self.__batch_timestamp = None
+            self.__row_buffer = None
+            self.__timestamp_buffer = None
+            if not check_existing:
+                if own_batch:
+                    self.begin_batch()
+                self.__create_secondary_indexes()
+            if own_batch:
+                self.commit_batch()
 
         self.database_postprocessing()
         return counter
 
+    def __next_rebuild_batch(self, own_batch):
+        """Writes the rows of the current batch of the rebuild and starts the next batch, the batch is committed
+        when the rebuild started it (own_batch)"""
+        self.__flush_rows()
+        if own_batch:
+            self.commit_batch()
+            self.begin_batch()
+        self.__batch_timestamp = time.time()
+
+    def __files_to_rebuild(self, directory, already_present, known_files):
+        """Yields (full filename, filename relative to the data directory) of all files to process in the rebuild,
+        skipping the directories of the patients in already_present and the files in known_files (dict with
+        ObjectFile/DatabaseTimeStamp) that were not modified after they were written to the database"""
+        string_startingpoint = len(self.data_directory) + 1
+
+        def skip_files_in(path):
+            mrn = path[string_startingpoint:]
+            if mrn in already_present:
+                log.info('Skipping Directory, PatientID already in database: '+str(mrn))
+                return True
+            return False
+
+        for entry in self.__iter_files(directory, skip_files_in):
+            filename = entry.path[string_startingpoint:]
+            timestamp = known_files.get(filename)
+            if timestamp is not None:
+                try:
+                    if entry.stat().st_mtime < float(timestamp):
+                        log.info('Skipping unchanged file: ' + entry.path)
+                        continue
+                except (OSError, ValueError):
+                    pass
+            yield entry.path, filename
+
+    def __iter_files(self, directory, skip_files_in=None):
+        """Yields the os.DirEntry of all files in directory and its subdirectories. Uses os.scandir, the directory
+        entries tell if they are a file or directory without an extra stat call
+
+        :param: skip_files_in : optional function called with each directory, if it returns True the files in that
+            directory are skipped (its subdirectories are still scanned)
+        """
+        skip_files = skip_files_in is not None and skip_files_in(directory)
+        subdirectories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        # like os.walk, symbolic links to directories are not followed
+                        if not entry.is_symlink():
+                            subdirectories.append(entry.path)
+                    elif not skip_files:
+                        yield entry
+        except OSError as e:
+            log.error('Cannot scan directory {} : {}'.format(directory, str(e)))
+
+        for subdirectory in subdirectories:
+            yield from self.__iter_files(subdirectory, skip_files_in)
+
     def store_dicom_file(self, filename, remove_after_store=False, sopinstance_as_filename=False):
         """Places dicom file in proper directory in data directory and updates database
 
@@ -425,27 +1158,30 @@ class pyconquest:
         :param: sopinstance_as_filename : if set to True the sopuid will become the new filename ( default : FALSE )
         """
         try:
-            ds = dcmread(filename)
-            patientid = ds[0x0010, 0x0020].value
+            ds = _read_dicom_tags(filename, self.__tags_to_read())
+            if ds is None:
+                log.error('Not storing {}, it is not a dicom file'.format(filename))
+                return
+            patientid = ds[_TAG_PATIENT_ID].value
 
             if sopinstance_as_filename:
-                SOPInstanceUID = ds[0x0008, 0x0018].value
+                SOPInstanceUID = ds[_TAG_SOP_INSTANCE_UID].value
                 target_base_filename = "{}.dcm".format(SOPInstanceUID)
             else:
                 target_base_filename = os.path.basename(filename)
 
-            target_filename = "{}/{}/{}".format(self.data_directory, patientid, target_base_filename)
+            path = os.path.join(self.data_directory, patientid)
+            target_filename = os.path.join(path, target_base_filename)
             target_filename_db = "{}/{}".format(patientid, target_base_filename)
-            path = "{}/{}".format(self.data_directory, patientid)
-            if not os.path.exists(path):
-                os.makedirs(path)
-                log.info("Directory " + path + " Created ")
+            os.makedirs(path, exist_ok=True)
 
-            shutil.copy(filename, target_filename)
-            log.info('stored file : {} in database at location: {}'.format(filename, target_filename))
             if remove_after_store:
-                os.remove(filename)
-                log.info('removed file : {}'.format(filename))
+                # a rename on the same filesystem, shutil.move only copies when the data directory is elsewhere
+                shutil.move(filename, target_filename)
+                log.info('moved file : {} to database at location: {}'.format(filename, target_filename))
+            else:
+                _fast_copy(filename, target_filename)
+                log.info('stored file : {} in database at location: {}'.format(filename, target_filename))
             self.write_tags(ds, target_filename_db)
 
         except Exception as e:
@@ -462,13 +1198,33 @@ class pyconquest:
         :param: sopinstance_as_filename : if set to True the sopuid will become the new filename ( default : FALSE )
          """
         if  os.path.exists(directory_name):
-            for root, dirs, files in os.walk(directory_name, topdown=True):
-                for name in files:
-                    full_filename = os.path.join(root, name)
+            counter = 0
+            # existence checks are done on the known uids and the files are committed in batches, unless the caller
+            # has started a batch
+            self.__load_known_uids()
+            own_batch = not self.conn_pacs.in_transaction
+            if own_batch:
+                self.begin_batch()
+            try:
+                for entry in self.__iter_files(directory_name):
+                    full_filename = entry.path
                     log.info('Processing ... ' + full_filename)
                     self.store_dicom_file(full_filename, remove_after_store=remove_after_store,
                                           sopinstance_as_filename=sopinstance_as_filename)
-            log.info('Processed {} files'.format(len(files)))
+                    counter = counter + 1
+                    if own_batch and counter % self.__files_per_commit == 0:
+                        self.commit_batch()
+                        self.begin_batch()
+            except Exception:
+                if own_batch:
+                    self.rollback_batch()
+                raise
+            finally:
+                self.__known_uids = None
+                self.__added_uids = None
+            if own_batch:
+                self.commit_batch()
+            log.info('Processed {} files'.format(counter))
             return 1
         else:
             log.error('Directory  : {} does not exist'.format(directory_name))
@@ -481,20 +1237,19 @@ class pyconquest:
         :returns: a dict with extra parameters
         """
         returndict = {}
-        returndict['DatabaseTimeStamp'] = time.time()
-        dicomtype = ds[0x0008, 0x0060].value
+        returndict['DatabaseTimeStamp'] = self.__timestamp()
+        dicomtype = ds[_TAG_MODALITY].value
         if dicomtype == 'RTSTRUCT':
             contours = ds[0x3006, 0x0020].value
             contournamelist = []
-            FrameOfReferenceUID_List = []
+            unique_frame_of_ref = set()
             for c in contours:
                 contournamelist.append(c[0x3006, 0x0026].value)
-                FrameOfReferenceUID_List.append(c[0x3006, 0x0024].value)
-            unique_frame_of_ref = list(set(FrameOfReferenceUID_List))
+                unique_frame_of_ref.add(c[0x3006, 0x0024].value)
             returndict['ElementList'] = contournamelist
             returndict['ElementCount'] = len(contournamelist)
             if len(unique_frame_of_ref) == 1:
-                returndict['UniqueFOR_UID'] = unique_frame_of_ref[0]
+                returndict['UniqueFOR_UID'] = unique_frame_of_ref.pop()
             else:
                 returndict['UniqueFOR_UID'] = ''
 
@@ -502,7 +1257,7 @@ class pyconquest:
                 #change the tags to make insensitive for anonimisation
                 ds.walk(self.__change_ReferencedSOPInstanceUID, recursive=True)
                 # hash only of contoursequence
-                returndict['hash'] = hashlib.md5(pickle.dumps(ds[0x3006, 0x0039].value)).hexdigest()
+                returndict['hash'] = self.__hash_sequence(ds[0x3006, 0x0039].value)
 
             try:
                 referenced_seriesuid = ds[0x3006, 0x0010][0][0x3006, 0x0012][0][0x3006, 0x0014][0][0x0020, 0x000e].value
@@ -531,7 +1286,7 @@ class pyconquest:
 
             # RTPLAN has only the hash of the beam sequence
             if self.__compute_hash:
-                returndict['hash'] = hashlib.md5(pickle.dumps(ds[0x300a, 0x00b0].value)).hexdigest()
+                returndict['hash'] = self.__hash_sequence(ds[0x300a, 0x00b0].value)
 
             try:
                 ReferencedSOPUID = ds[0x300c, 0x0060][0][0x0008, 0x1155].value
@@ -547,11 +1302,59 @@ class pyconquest:
                 log.error('Error when extracting referenced_seriesuid of RTPLAN from RTDOSE file')
 
             if self.__compute_hash:
-                returndict['hash'] = hashlib.md5(pickle.dumps(ds.PixelData)).hexdigest()
+                # the pixel data are bytes already, so they are hashed as is
+                if 'PixelData' in ds:
+                    returndict['hash'] = self.__new_hash(ds.PixelData).hexdigest()
+                else:
+                    # the pixel data is skipped when reading the tags, so it is hashed from the file here
+                    returndict['hash'] = self.__hash_pixel_data_from_file(os.path.join(self.data_directory, filename))
 
         return returndict
 
 
+    def __hash_sequence(self, sequence):
+        """Returns the hexdigest of a sequence, hashing the tag and value of every element one by one so no
+        serialized copy of the whole sequence is made"""
+        sequence_hash = self.__new_hash()
+        self.__update_hash(sequence_hash, sequence)
+        return sequence_hash.hexdigest()
+
+    def __update_hash(self, sequence_hash, sequence):
+        for item in sequence:
+            for element in item:
+                sequence_hash.update(str(element.tag).encode())
+                if element.VR == 'SQ':
+                    self.__update_hash(sequence_hash, element.value)
+                else:
+                    sequence_hash.update(str(element.value).encode())
+
+    def __hash_pixel_data_from_file(self, filename):
+        """Returns the hexdigest of the PixelData of a file. The pixel data are hashed from a read only memory map of
+        the file, so they are not read into memory first. Encapsulated pixel data (undefined length) and older pydicom
+        versions (before 3.0 get_item can not return the deferred element) read the pixel data with dcmread"""
+        with open(filename, 'rb') as file:
+            # the large values are not read, only their position in the file is
+            ds = dcmread(file, defer_size=1024, specific_tags=[(0x7fe0, 0x0010)])
+            try:
+                raw_pixeldata = ds.get_item(0x7fe00010, keep_deferred=True)
+            except TypeError:
+                raw_pixeldata = None
+            if not isinstance(raw_pixeldata, RawDataElement) or raw_pixeldata.length == 0xffffffff:
+                file.seek(0)
+                ds = dcmread(file, specific_tags=[(0x7fe0, 0x0010)])
+                if 'PixelData' not in ds:
+                    return None
+                return self.__new_hash(ds.PixelData).hexdigest()
+            start = raw_pixeldata.value_tell
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as file_map, memoryview(file_map) as view, \
+                    view[start:start + raw_pixeldata.length] as pixeldata:
+                return self.__new_hash(pixeldata).hexdigest()
+
+    def __new_hash(self, data=b''):
+        """Returns a new hash object for the hash column, blake2b with a 16 byte digest so the hexdigest has the same
+        length as the md5 used before"""
+        return hashlib.blake2b(data, digest_size=16)
+
     def __change_ReferencedSOPInstanceUID(self,ds,element):
         if element.keyword == 'ReferencedSOPInstanceUID':
             ds.ReferencedSOPInstanceUID = ''
@@ -565,15 +1368,26 @@ class pyconquest:
         :param: mrn : delete for the given mrn in a fast manner, so only all the database entries with a direct query
         :returns: nothing
         """
+        self.__forget_recent_uids()
         if mrn is not None:
             if delete_files == True:
                 log.error('Cannot delete on mrn and physically delete the files')
                 return(-1)
             else:
-                self.execute_db_query(query='delete from dicomimages where imagepat="{}"'.format(mrn))
-                self.execute_db_query(query='delete from dicomseries where seriespat="{}"'.format(mrn))
-                self.execute_db_query(query='delete from dicomstudies where PatientID="{}"'.format(mrn))
-                self.execute_db_query(query='delete from dicompatients where PatientID="{}"'.format(mrn))
+                own_batch = not self.conn_pacs.in_transaction
+                if own_batch:
+                    self.begin_batch()
+                try:
+                    self.execute_db_query(query='delete from dicomimages where imagepat=?', params=(mrn,))
+                    self.execute_db_query(query='delete from dicomseries where seriespat=?', params=(mrn,))
+                    self.execute_db_query(query='delete from dicomstudies where PatientID=?', params=(mrn,))
+                    self.execute_db_query(query='delete from dicompatients where PatientID=?', params=(mrn,))
+                except Exception:
+                    if own_batch:
+                        self.rollback_batch()
+                    raise
+                if own_batch:
+                    self.commit_batch()
 
                 log.info('Deleted all database entries for patient {} from the database tables'.format(mrn))
                 return(1)
@@ -585,111 +1399,138 @@ class pyconquest:
             self.delete_series(seriesuid=serieslist, delete_files=delete_files)
             return()
 
-        if isinstance(seriesuid, list): #recursive call in case of list as input
-            for suid in seriesuid:
-                self.delete_series(seriesuid=suid, delete_files=delete_files)
+        # all series are deleted from the database in one transaction, unless the caller has started a batch
+        own_batch = not self.conn_pacs.in_transaction
+        if own_batch:
+            self.begin_batch()
+        try:
+            if isinstance(seriesuid, list):
+                for suid in seriesuid:
+                    self.__delete_single_series(suid, delete_files)
+            else:
+                self.__delete_single_series(seriesuid, delete_files)
+        except Exception:
+            if own_batch:
+                self.rollback_batch()
+            raise
+        if own_batch:
+            self.commit_batch()
+        if isinstance(seriesuid, list):
             return()
 
-        # single seriesuid given
-        else:
-            file_query = "select ObjectFile,ImagePat,dicomseries.StudyInsta from dicomimages \
-                            inner join dicomseries on (dicomseries.SeriesInst = dicomimages.seriesinst) \
-                            where dicomimages.seriesinst==\"{}\"".format(seriesuid)
+    def __delete_single_series(self, seriesuid, delete_files):
+        """Deletes the files and the database rows of one series, the study and patient rows are deleted when they
+        have no series or studies left"""
+        file_query = "select ObjectFile,ImagePat,dicomseries.StudyInsta from dicomimages \
+                        inner join dicomseries on (dicomseries.SeriesInst = dicomimages.seriesinst) \
+                        where dicomimages.seriesinst=?"
 
-            return_list = self.execute_db_query(file_query)
-            if(len(return_list) == 0):
-                log.info('no images found for this seriesuid : '+seriesuid)
-                return
+        return_list = self.execute_db_query(file_query, params=(seriesuid,))
+        if(len(return_list) == 0):
+            log.info('no images found for this seriesuid : '+seriesuid)
+            return
 
-            for row in return_list:
-                studyuid = row['StudyInsta']
-                patientid = row['ImagePat']
-                filename = "{}/{}".format(self.data_directory, row['ObjectFile'])
-                if os.path.exists(filename):
-                    if delete_files:
-                        os.remove(filename)
-                        log.info('deleting ' + filename)
-                    else:
-                        log.info('not deleting file, only DB entries,  since delete_files=False'.format(filename))
+        filenames = []
+        data_directory = self.data_directory
+        for row in return_list:
+            filename = os.path.join(data_directory, row['ObjectFile'])
+            if os.path.exists(filename):
+                if delete_files:
+                    filenames.append(filename)
+                    log.info('deleting ' + filename)
                 else:
-                    log.error("The file you want to delete does not exist")
-
-                #delete dicomimage table entry
-                query='delete from dicomimages where ObjectFile="{}"'.format(row['ObjectFile'])
-                self.execute_db_query(query)
-
-
-            #delete dicomseries table entry
-            query='delete from dicomseries where seriesinst="{}"'.format(seriesuid)
-            self.execute_db_query(query)
+                    log.info('not deleting file, only DB entries,  since delete_files=False'.format(filename))
+            else:
+                log.error("The file you want to delete does not exist")
+
+        # the unlinks are I/O bound (slow on network storage), so they are done in a few threads at the same time
+        if filenames:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.__delete_workers) as executor:
+                list(executor.map(os.remove, filenames))
+        studyuid = return_list[-1]['StudyInsta']
+        patientid = return_list[-1]['ImagePat']
+
+        # delete all dicomimages and the dicomseries table entry with one statement each
+        self.execute_db_query('delete from dicomimages where seriesinst=?', params=(seriesuid,))
+        self.execute_db_query('delete from dicomseries where seriesinst=?', params=(seriesuid,))
+
+        # now delete the study entry in db if this was the last series, and the patient if this was the last study
+        changes_before_delete = self.conn_pacs.total_changes
+        self.execute_db_query('delete from dicomstudies where StudyInsta=? and not exists '
+                              '(select 1 from dicomseries where studyinsta=?)', params=(studyuid, studyuid))
+        if self.conn_pacs.total_changes != changes_before_delete:
+            log.info('no more series : now deleting studiuid entry in db : {}'.format(studyuid))
+
+        changes_before_delete = self.conn_pacs.total_changes
+        self.execute_db_query('delete from dicompatients where PatientID=? and not exists '
+                              '(select 1 from dicomstudies where PatientID=?)', params=(patientid, patientid))
+        if self.conn_pacs.total_changes != changes_before_delete:
+            log.info('no more studies : now deleting patient db entry with number : {}'.format(patientid))
 
-            #now delete the study entry in db if this is the last ...
-            query_for_remaining_series='select count(*) as nr from dicomseries where studyinsta="{}"'.format(studyuid)
-            remaining_series = self.execute_db_query(query_for_remaining_series)
-            if remaining_series[0]['nr'] == 0:
-                query = 'delete from dicomstudies where StudyInsta="{}"'.format(studyuid)
-                self.execute_db_query(query)
-                log.info('no more series : now deleting studiuid entry in db : {}'.format(studyuid))
-
-            query_for_remaining_studies = 'select count(*) as nr from dicomstudies where PatientID="{}"'.format(patientid)
-            remaining_studies = self.execute_db_query(query_for_remaining_studies)
-            if remaining_studies[0]['nr'] == 0:
-                query = 'delete from dicompatients where PatientID="{}"'.format(patientid)
-                self.execute_db_query(query)
-                log.info('no more studies : now deleting patient db entry with number : {}'.format(patientid))
     #
     #   Some utility routines not part of base functionality of conquest, but handy
     #
 
     def copy_dicom_files_to_dest(self, seriesuid=None, query=None, destination='', CreateDir=True,
-                                 UseSubDirectories=False):
+                                 UseSubDirectories=False, max_workers=None):
         """Copies all dicom files belonging to a series to destination, described by either a seriesuid or a query.
 
         :param: serieuid : a single string (one seriesuid) or a list of seriesuids of series that should be copied
         :param: query  : should be a query for seriesuids, the query should return at least one column : SeriesInst
         :param: CreateDir : determines of a directory is created if it does not exist ( default = True)
         :param: UseSubDirectories : determines if when storig subdirectories with the name PatientID are used ( default=False)
+        :param: max_workers : number of files copied at the same time ( default=8 ), more helps for network storage,
+            use 1 to copy one file at a time ( e.g. for a single local disk )
         """
+        if max_workers is None:
+            max_workers = self.__copy_workers
 
         if not seriesuid is None:
-            if isinstance(seriesuid, list): #recursive call in case of list as input
-                for suid in seriesuid:
-                    self.copy_dicom_files_to_dest(seriesuid=suid, destination=destination,
-                                                  CreateDir=CreateDir, UseSubDirectories=UseSubDirectories)
-                return
+            if isinstance(seriesuid, (list, tuple)):
+                # the files of all series are selected with a few IN queries, sqlite limits the number of parameters
+                file_query = "select ObjectFile,ImagePat from dicomimages where seriesinst in ({})"
+                chunks = [seriesuid[i:i + self.__max_query_parameters]
+                          for i in range(0, len(seriesuid), self.__max_query_parameters)]
+                rows = itertools.chain.from_iterable(
+                    self.execute_db_query_iter(file_query.format(','.join('?' * len(chunk))), params=tuple(chunk))
+                    for chunk in chunks)
             else:
-                file_query = "select ObjectFile,ImagePat from dicomimages where seriesinst=\"{}\"".format(seriesuid)
-                return_list = self.execute_db_query(file_query)
+                file_query = "select ObjectFile,ImagePat from dicomimages where seriesinst=?"
+                rows = self.execute_db_query_iter(file_query, params=(seriesuid,))
         elif not query is None:
-            series_list = self.execute_db_query(query)
-            for row in series_list:
-                suid = row['SeriesInst']
-                self.copy_dicom_files_to_dest(seriesuid=suid, destination=destination,
-                                              CreateDir=CreateDir, UseSubDirectories=UseSubDirectories)
-            return
+            rows = self.__query_files_of_series('ObjectFile,ImagePat', query)
+            if rows is None:
+                return -1
         else:
             log.error('As yet unimplemented option in copy_dicom_files_to_dest')
             return -1
 
-        if return_list and CreateDir:
-            if not os.path.exists(destination):
-                os.makedirs(destination)
-                log.info("Directory "+destination+ " Created ")
-
-        if not UseSubDirectories:
-            for row in return_list:
-                filename = "{}/{}".format(self.data_directory, row['ObjectFile'])
-                log.info('copying ' + filename + ' to dest : ' + destination)
-                shutil.copy(filename, destination)
-        else:
-            for row in return_list:
-                filename = "{}/{}".format(self.data_directory, row['ObjectFile'])
-                destination_patientdir = "{}/{}".format(destination, row['ImagePat'])
-                if not os.path.exists(destination_patientdir):
-                    os.makedirs(destination_patientdir)
-                    log.info("Directory " + destination_patientdir + " Created ")
-                log.info('copying ' + filename + ' to dest : ' + destination_patientdir)
-                shutil.copy(filename, destination_patientdir)
+        # the copies are I/O bound, so they are done in a few threads at the same time
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            copies = []
+            # each target directory is checked and created only once
+            target_directories = set()
+            data_directory = self.data_directory
+            for objectfile, imagepat in rows:
+                if not copies and CreateDir:
+                    if _create_directory(destination):
+                        log.info("Directory "+destination+ " Created ")
+
+                filename = os.path.join(data_directory, objectfile)
+                if not UseSubDirectories:
+                    target_directory = destination
+                else:
+                    target_directory = os.path.join(destination, imagepat)
+                    if target_directory not in target_directories:
+                        target_directories.add(target_directory)
+                        if _create_directory(target_directory):
+                            log.info("Directory " + target_directory + " Created ")
+                log.info('copying ' + filename + ' to dest : ' + target_directory)
+                copies.append(executor.submit(_fast_copy, filename, target_directory))
+
+            # raises the exception of a failed copy, like the copies in this thread did
+            for copy in copies:
+                copy.result()
         return 1
 
     #
@@ -697,7 +1538,7 @@ class pyconquest:
     #
 
     def send_dicom(self, addres='127.0.0.1',port=5678, patientid='', seriesuid='',query='', ae_title=b'PYNETDICOM',
-                   sending_ae_title=b'pyconquest'):
+                   sending_ae_title=b'pyconquest', keep_association=False):
         """Sends dicom files via the dicom protocol to a (remote) destination, select on patientid, seriesuid or query
 
         :param: addres : IP address of the dicom destination (computer)
@@ -707,29 +1548,54 @@ class pyconquest:
         :param: query : sends all files resulting from this query, should contain 1 column called SeriesInst with the seriesuid
         :param: ae_title : AE title of destination ( Default PYNETDICOM )
         :param: sending_ae_title : AE title of the sender (me) ( Default : pyconquest )
+        :param: keep_association : if True the association stays open for the next send to the same destination,
+            see send_dicom_file ( Default : False )
         """
-        filename_list = []
+        params = None
         if not patientid == '':
-            query = 'Select ObjectFile from DICOMimages where imagepat=\'{}\''.format(patientid)
+            query = 'Select ObjectFile from DICOMimages where imagepat=?'
+            params = (patientid,)
         elif not seriesuid == '':
-            query = 'Select ObjectFile from DICOMimages where seriesinst=\'{}\''.format(seriesuid)
+            query = 'Select ObjectFile from DICOMimages where seriesinst=?'
+            params = (seriesuid,)
         elif not query == '':
-            series_list = self.execute_db_query(query=query)
+            # the files of all series of the query are sent over one association
             log.info('Now sending using query: {}'.format(query))
-            for it in series_list:
-                ser=it['SeriesInst']
-                self.send_dicom(addres=addres, port=port, seriesuid=ser, ae_title=ae_title,
-                                sending_ae_title=sending_ae_title)
+        else:
+            log.error('Give a patientid, seriesuid or query to send_dicom')
             return
 
         # query for filenames and fill list of fienames
-        result = self.execute_db_query(query)
-        for line in result:
-            filename_list.append(self.data_directory + '\\' + line['ObjectFile'])
+        if params is None:
+            rows = self.__query_files_of_series('ObjectFile', query)
+            if rows is None:
+                return
+        else:
+            rows = self.execute_db_query_iter(query, params=params)
+        data_directory = self.data_directory
+        filename_list = [os.path.join(data_directory, objectfile) for objectfile, in rows]
+        if not filename_list:
+            # no association is opened when there is nothing to send
+            log.info('No files found to send')
+            return
 
-        self.send_dicom_file(addres, port, filename_list, aetitle=ae_title, sending_ae_title=sending_ae_title)
+        self.send_dicom_file(addres, port, filename_list, aetitle=ae_title, sending_ae_title=sending_ae_title,
+                             keep_association=keep_association)
+
+    def __query_files_of_series(self, columns, query):
+        """Returns a cursor over the columns of the DICOMimages rows of the series selected by query (with a column
+        SeriesInst), or None when the query fails"""
+        # the query is used as a subquery, which can not end with a ;
+        query = query.strip().rstrip(';')
+        file_query = 'select {} from DICOMimages where seriesinst in (select SeriesInst from ({}))'.format(columns, query)
+        try:
+            return self.conn_pacs.execute(file_query)
+        except Exception as e:
+            log.error('exception {} encountered in the query for the series : {}'.format(str(e), query))
+            return None
 
-    def send_dicom_file(self, addres, port, filename_list, aetitle=b'PYNETDICOM', sending_ae_title=b'pyconquest'):
+    def send_dicom_file(self, addres, port, filename_list, aetitle=b'PYNETDICOM', sending_ae_title=b'pyconquest',
+                        keep_association=False):
         """Send a dicom file via DICOM protocol to a destination
 
         :param: addres : IP address of the dicom destination (computer)
@@ -737,30 +1603,86 @@ class pyconquest:
         :param: filename_list : either a single file or a list of filenames to send
         :param: aetitle : AEtitle of destination ( Default PYNETDICOM )
         :param: sending_ae_title : AE title of the sender (me) ( Default : pyconquest )
+        :param: keep_association : if True the association is not released after sending, the next send to the same
+            destination reuses it instead of associating again. Release them with close_associations() ( Default : False )
         """
+        if isinstance(filename_list, str):
+            filename_list = [filename_list]
+
+        _begin_timer_resolution()
+        try:
+            self.__send_files_over_association(addres, port, aetitle, sending_ae_title, filename_list,
+                                               keep_association)
+        finally:
+            _end_timer_resolution()
+
+    def close_associations(self):
+        """Releases the associations kept open by send_dicom_file(keep_association=True)"""
+        associations, self.__associations = self.__associations, {}
+        for assoc in associations.values():
+            if assoc.is_established:
+                assoc.release()
+
+    def __associate(self, addres, port, aetitle, sending_ae_title):
+        """Returns a new association with the destination, check is_established before use"""
         # Initialise the Application Entity
-        ae = AE(ae_title=sending_ae_title)
+        pynetdicom = _pynetdicom()
+        ae = pynetdicom.AE(ae_title=sending_ae_title)
 
         # Add a requested presentation context
-        ae.requested_contexts = StoragePresentationContexts
+        ae.requested_contexts = pynetdicom.StoragePresentationContexts
 
-        assoc = ae.associate(addres, port, ae_title=aetitle)
-        if assoc.is_established:
-            # Use the C-STORE service to send the dataset
-            # returns the response status as a pydicom Dataset
-            for filename in filename_list:
-                ds = dcmread(filename)
-                status = assoc.send_c_store(ds)
+        # no limit on the size of the received PDUs
+        ae.maximum_pdu_size = 0
 
-                # Check the status of the storage request
-                if status:
-                    # If the storage request succeeded this will be 0x0000
-                    log.info('C-STORE request status: 0x{0:04x}'.format(status.Status))
-                else:
-                    log.error('Connection timed out, was aborted or received invalid response')
+        return ae.associate(addres, port, ae_title=aetitle)
+
+    def __send_files_over_association(self, addres, port, aetitle, sending_ae_title, filename_list, keep_association):
+        """Sends the files over one association with the destination, a kept open association is reused"""
+        key = (addres, port, aetitle, sending_ae_title)
+        assoc = self.__associations.pop(key, None)
+        if assoc is None or not assoc.is_established:
+            assoc = self.__associate(addres, port, aetitle, sending_ae_title)
+        if assoc.is_established:
+            if _pynetdicom_sends_files():
+                # pynetdicom reads the files itself, so they are not read here as well
+                datasets = filename_list
+                send = functools.partial(self.__send_file, assoc)
+            else:
+                # the files are read in a separate thread, so reading the next file overlaps with sending this one
+                read_queue = queue.Queue(maxsize=4)
+                reader = threading.Thread(target=self.__read_files_ahead, args=(filename_list, read_queue),
+                                          daemon=True)
+                reader.start()
+                datasets = iter(read_queue.get, None)
+                send = assoc.send_c_store
+            # the files are streamed from disk instead of decoded and encoded again, only while sending these files
+            stream_files = _begin_streaming_files()
+            try:
+                # Use the C-STORE service to send the dataset
+                # returns the response status as a pydicom Dataset
+                for ds in datasets:
+                    try:
+                        status = send(ds)
+                    except Exception as e:
+                        log.error('Error {} when sending file {}'.format(str(e), getattr(ds, 'filename', ds)))
+                        continue
+
+                    # Check the status of the storage request
+                    if status:
+                        # If the storage request succeeded this will be 0x0000
+                        log.info('C-STORE request status: 0x{0:04x}'.format(status.Status))
+                    else:
+                        log.error('Connection timed out, was aborted or received invalid response')
+            finally:
+                if stream_files:
+                    _end_streaming_files()
 
-            # Release the association
-            assoc.release()
+            if keep_association and assoc.is_established:
+                self.__associations[key] = assoc
+            else:
+                # Release the association
+                assoc.release()
         else:
             if assoc.is_rejected:
                 msg = ('{0}: {1}'.format(
@@ -771,6 +1693,26 @@ class pyconquest:
             else:
                 log.error('Association aborted or never connected')
 
+    def __send_file(self, assoc, filename):
+        """Sends the file with pynetdicom 2.0 or later. Files that can not be streamed (incomplete file meta
+        information or a transfer syntax the destination did not accept) are read and sent as a dataset, so
+        pynetdicom can convert them"""
+        try:
+            return assoc.send_c_store(filename)
+        except (AttributeError, ValueError):
+            return assoc.send_c_store(dcmread(filename))
+
+    def __read_files_ahead(self, filename_list, read_queue):
+        """Reads the files and puts the datasets in read_queue, ends with None"""
+        try:
+            for filename in filename_list:
+                try:
+                    read_queue.put(dcmread(filename))
+                except Exception as e:
+                    log.error('Error {} when reading file {} to send'.format(str(e), filename))
+        finally:
+            read_queue.put(None)
+
     def __log_open_dcm_connection(self,event):
         """Print the remote's (host, port) when connected."""
         msg = 'Connected with remote (host, port) : {} : {}'.format(event.address, event.assoc.remote)
@@ -792,13 +1734,23 @@ class pyconquest:
             self.__write_to_database_when_receiving_dicom_data = False
             print('Not updating the database when receiving data (write_to_database was set to False !)')
 
+        pynetdicom = _pynetdicom()
+        evt = pynetdicom.evt
         handlers = [(evt.EVT_C_STORE, self.handle_dicom_store_request),
-                    (evt.EVT_CONN_OPEN, self.__log_open_dcm_connection)]
+                    (evt.EVT_CONN_OPEN, self.__log_open_dcm_connection),
+                    (evt.EVT_ACCEPTED, _begin_timer_resolution),
+                    (evt.EVT_RELEASED, _end_timer_resolution),
+                    (evt.EVT_ABORTED, _end_timer_resolution),
+                    (evt.EVT_ACCEPTED, self.__open_association),
+                    (evt.EVT_RELEASED, self.__close_association),
+                    (evt.EVT_ABORTED, self.__close_association)]
 
         # Initialise the Application Entity
-        ae = AE()
+        ae = pynetdicom.AE()
+        # no limit on the size of the received PDUs
+        ae.maximum_pdu_size = 0
         # Support presentation contexts for all storage SOP Classes
-        ae.supported_contexts = AllStoragePresentationContexts
+        ae.supported_contexts = pynetdicom.AllStoragePresentationContexts
         # Start listening for incoming association requests
         ae.start_server(('', port), evt_handlers=handlers)
 
@@ -815,28 +1767,86 @@ class pyconquest:
 
         # Add the File Meta Information
         ds.file_meta = event.file_meta
-        patientid = ds[0x0010, 0x0020].value
+        patientid = ds[_TAG_PATIENT_ID].value
 
-        filename = "{}/{}/{}.dcm".format(self.data_directory, patientid, ds.SOPInstanceUID)
-        path = "{}/{}".format(self.data_directory, patientid)
-        if not os.path.exists(path):
-            os.makedirs(path)
+        path = os.path.join(self.data_directory, patientid)
+        filename = os.path.join(path, "{}.dcm".format(ds.SOPInstanceUID))
+        if _create_directory(path):
             print("Directory " + path + " Created ")
 
-        # Save the dataset using the SOP Instance UID as the filename
-        ds.save_as(filename, write_like_original=False)
+        # Save the dataset using the SOP Instance UID as the filename. From pynetdicom 2.0 the received bytes are
+        # written as they are, instead of encoding the decoded dataset again
+        if hasattr(event, 'encoded_dataset'):
+            with open(filename, 'wb') as file:
+                file.write(event.encoded_dataset())
+        else:
+            ds.save_as(filename, write_like_original=False)
         print('dicom saved to file : ' + filename)
 
         if self.__write_to_database_when_receiving_dicom_data is True:
-            ds2 = dcmread(filename)
-            c2 = pyconquest(database_filename=self.database_filename, data_directory=self.data_directory,loglevel='INFO')
+            # the dataset is still in memory, so no need to read the file again. The handlers run in the threads
+            # of the associations, so the writes to the shared connection are serialized
             filename2 = "{}/{}".format(patientid, os.path.basename(filename))
-            c2.write_tags(ds2, filename2)
-            c2.close_db()
+            with self.__db_lock:
+                if self.__open_associations > 0:
+                    # the rows of the files received while associations are open are kept in memory and written in
+                    # one short transaction when an association ends, every __files_per_commit files or after
+                    # __seconds_per_commit, instead of a transaction for each file
+                    if not self.__received_rows:
+                        self.__received_batch_start = time.monotonic()
+                    self.__received_rows.append(self.create_rows(ds, filename2))
+                    if len(self.__received_rows) >= self.__files_per_commit or \
+                            time.monotonic() - self.__received_batch_start >= self.__seconds_per_commit:
+                        self.__write_received_rows()
+                else:
+                    self.write_tags(ds, filename2)
 
         # Return a 'Success' status
         return 0x0000
 
+    def __open_association(self, event):
+        with self.__db_lock:
+            self.__open_associations += 1
+
+    def __close_association(self, event):
+        """Writes the received rows when an association of the listener is released or aborted. The rows of the
+        other open associations are written with them"""
+        with self.__db_lock:
+            self.__open_associations = max(self.__open_associations - 1, 0)
+            self.__write_received_rows()
+
+    def __write_received_rows(self):
+        """Writes the rows of the received files in one transaction. When that fails the files are written one by
+        one, so only the files with an error are not written"""
+        received_rows, self.__received_rows = self.__received_rows, []
+        if not received_rows:
+            return
+        own_batch = not self.conn_pacs.in_transaction
+        if own_batch:
+            self.begin_batch()
+        try:
+            for uids, rows in received_rows:
+                self.__write_rows(uids, rows)
+        except Exception as e:
+            if not own_batch:
+                raise
+            self.rollback_batch()
+            log.error('Error {} when writing {} received files, now writing them one by one'.format(
+                str(e), len(received_rows)))
+            for uids, rows in received_rows:
+                self.begin_batch()
+                try:
+                    self.__write_rows(uids, rows)
+                except Exception as e:
+                    self.rollback_batch()
+                    log.error('Error {} when writing the received file {}'.format(
+                        str(e), rows['DICOMimages'].get('ObjectFile')))
+                else:
+                    self.commit_batch()
+            return
+        if own_batch:
+            self.commit_batch()
+
     #
     # examine database
     #
@@ -850,32 +1860,54 @@ class pyconquest:
         :type orderby : string
         :param print_summary : if True (default) the summary is printed
         """
-
-        query = "select distinct patientid " \
-                ",(select count(*) from dicomseries where seriespat=patientid and modality=\'CT\') as nrCT" \
-                ",(select count(*) from dicomseries where seriespat=patientid and modality=\'MR\') as nrMR" \
-                ",(select count(*) from dicomseries where seriespat=patientid and modality=\'PT\') as nrPT" \
-                ",(select count(*) from dicomseries where seriespat=patientid and modality=\'RTSTRUCT\') as nrRTSTRUCT"\
-                ",(select count(*) from dicomseries where seriespat=patientid and modality=\'RTDOSE\') as nrRTDOSE" \
-                ",(select count(*) from dicomseries where seriespat=patientid and modality=\'RTPLAN\') as nrRTPLAN" \
-                " from dicompatients order by {}".format(orderby)
-        result = self.execute_db_query(query)
+        # the result is reused as long as the database did not change
+        signature = self.__database_signature()
+        cached = self.__summary_cache.get(orderby)
+        if cached is not None and cached[0] == signature:
+            result = [dict(row) for row in cached[1]]
+        else:
+            result = self.__query_series_summary(orderby)
+            if result is not None:
+                self.__summary_cache[orderby] = (signature, [dict(row) for row in result])
 
         if print_summary:
-            print('    PatientID    nrCT nrMR  nrPT nrRTSTRUCT nrRTDOSE nrRTPLAN')
-            rowcount=0
-            for r in result:
-                rowcount=rowcount+1
-                print('{}{}{}{}{}{}{}{}'.format(str(rowcount).ljust(5),
-                    r['PatientID'].ljust(14),
-                    str(r['nrCT']).ljust(5),
-                    str(r['nrMR']).ljust(5),
-                    str(r['nrPT']).ljust(8),
-                    str(r['nrRTSTRUCT']).ljust(10),
-                    str(r['nrRTDOSE']).ljust(10),
-                    str(r['nrRTPLAN']).ljust(8)))
+            # the lines are written to stdout at once instead of with a print per patient
+            line_format = '{:<5}{:<14}{:<5}{:<5}{:<8}{:<10}{:<10}{:<8}\n'.format
+            lines = ['    PatientID    nrCT nrMR  nrPT nrRTSTRUCT nrRTDOSE nrRTPLAN\n']
+            for rowcount, r in enumerate(result, start=1):
+                lines.append(line_format(rowcount, r['PatientID'], r['nrCT'], r['nrMR'], r['nrPT'], r['nrRTSTRUCT'],
+                                         r['nrRTDOSE'], r['nrRTPLAN']))
+            sys.stdout.write(''.join(lines))
 
         return result
+
+    def __database_signature(self):
+        """Returns a value that changes when the database is changed: total_changes counts the rows changed by this
+        connection, data_version changes on a commit of another connection (e.g. a dicom listener) and
+        schema_version when tables are created or dropped"""
+        data_version = self.conn_pacs.execute('PRAGMA data_version').fetchone()[0]
+        schema_version = self.conn_pacs.execute('PRAGMA schema_version').fetchone()[0]
+        return self.conn_pacs.total_changes, data_version, schema_version
+
+    def __query_series_summary(self, orderby):
+        """Queries the number of series per modality of each patient for dicom_series_summary"""
+        # counts all modalities in one pass over the series of each patient. With the unique index on PatientID the
+        # patients are read in PatientID order from the index, so no distinct and no sort for the group by are needed
+        if 'DICOMpatients' in self.__unique_key_tables:
+            patients = "dicompatients"
+        else:
+            patients = "(select distinct patientid from dicompatients)"
+        query = "select p.PatientID as PatientID" \
+                ",count(case when s.modality=\'CT\' then 1 end) as nrCT" \
+                ",count(case when s.modality=\'MR\' then 1 end) as nrMR" \
+                ",count(case when s.modality=\'PT\' then 1 end) as nrPT" \
+                ",count(case when s.modality=\'RTSTRUCT\' then 1 end) as nrRTSTRUCT" \
+                ",count(case when s.modality=\'RTDOSE\' then 1 end) as nrRTDOSE" \
+                ",count(case when s.modality=\'RTPLAN\' then 1 end) as nrRTPLAN" \
+                " from {} as p" \
+                " left join dicomseries as s on s.seriespat=p.patientid" \
+                " group by p.patientid order by {}".format(patients, orderby)
+        return self.execute_db_query(query)
     # some utility functions that are handy to have in the base class
 
     def dump_data_to_csv(self, query=None, table='dicomseries', filename_dict=None, filename='query_dump.csv'):
@@ -1003,21 +2035,39 @@ class pyconquest:
         Return:
             filtered list of roinames
         """
+        if not roinames:
+            return []
         returnlist = []
+        exclude_patterns, include_patterns = self.__compiled_roi_filters()
         # the if statement is because when the pattern is empty string, everything is matched in re
         if self.exclude_filter[0] != '':
-            for pattern in self.exclude_filter:
-                p = re.compile(pattern, self.roi_filter_flags)
-                roinames = [roiname for roiname in roinames if not p.match(roiname)]
+            for p in exclude_patterns:
+                match = p.match
+                roinames = [roiname for roiname in roinames if not match(roiname)]
 
-        for pattern in self.include_filter:
-            p = re.compile(pattern, self.roi_filter_flags)
-            for roiname in roinames:
-                if p.match(roiname):
-                    returnlist.append(roiname)
+        for p in include_patterns:
+            match = p.match
+            returnlist.extend(roiname for roiname in roinames if match(roiname))
 
         return returnlist
 
+    def __compiled_roi_filters(self):
+        """Returns the compiled exclude and include patterns, compiled again only when the filters or flags changed.
+        The exclude patterns are combined in one alternation, so each roiname is matched once. The include patterns
+        are kept apart, filter_roinames returns the roinames in the order of the include patterns"""
+        key = (tuple(self.exclude_filter), tuple(self.include_filter), self.roi_filter_flags)
+        if key != self.__roi_patterns_key:
+            try:
+                exclude_patterns = [re.compile('|'.join('(?:{})'.format(pattern) for pattern in self.exclude_filter),
+                                               self.roi_filter_flags)]
+            except re.error:
+                # e.g. inline global flags like (?i) are only allowed at the start of a pattern
+                exclude_patterns = [re.compile(pattern, self.roi_filter_flags) for pattern in self.exclude_filter]
+            self.__roi_patterns = (exclude_patterns,
+                                   [re.compile(pattern, self.roi_filter_flags) for pattern in self.include_filter])
+            self.__roi_patterns_key = key
+        return self.__roi_patterns
+
     def __create_db_views(self):
         v_series = '''
             create view v_series as
@@ -1043,17 +2093,38 @@ class pyconquest:
 
     def __create_db_index_tables(self):
         """Creates database index tables to speed up queries"""
+        self.__create_secondary_indexes()
+
+        # unique indexes on the keys, these let INSERT OR IGNORE skip rows that are already present
+        self.__unique_key_tables = set()
+        for tablename, colname in self.__key_columns.items():
+            index_unique = 'CREATE UNIQUE INDEX IF NOT EXISTS "unique_{}" ON "{}" ("{}")'.format(
+                tablename.lower(), tablename, colname)
+            if self.execute_db_query(index_unique) is None:
+                log.error('Could not create unique index on {}.{}, the table probably contains double entries; '
+                          'recreate the tables to fix this'.format(tablename, colname))
+                continue
+            self.__unique_key_tables.add(tablename)
+            # the unique index replaces the non unique index of older versions
+            self.execute_db_query('DROP INDEX IF EXISTS "index_{}"'.format(tablename.lower()))
+        log.info('Created secondary indexes and unique indexes on {}'.format(self.__unique_key_tables))
+
+    def __create_secondary_indexes(self):
+        """Creates the non unique indexes of __secondary_indexes whose columns are in the database definition"""
+        for indexname in self.__replaced_indexes:
+            self.execute_db_query('DROP INDEX IF EXISTS "{}"'.format(indexname))
+        for indexname, (tablename, colnames) in self.__secondary_indexes.items():
+            table_columns = [colname for tag, colname in self.__db_design.get(tablename, [])]
+            if tablename == 'DICOMimages':
+                table_columns += self.__extra_imagetable_columns
+            if all(colname in table_columns for colname in colnames):
+                self.execute_db_query('CREATE INDEX IF NOT EXISTS "{}" ON "{}" ({})'.format(
+                    indexname, tablename, ','.join('"{}"'.format(colname) for colname in colnames)))
 
-        index_dicomimages = \
-            'CREATE INDEX IF NOT EXISTS "index_dicomimages" ON "DICOMimages" ("SOPInstanc")'
-        index_dicomseries = \
-            'CREATE INDEX IF NOT EXISTS "index_dicomseries" ON "DICOMseries" ("SeriesInst")'
-        index_dicomimages_seriesinst = \
-            'CREATE INDEX IF NOT EXISTS "index_dicomimages_seriesinst" ON "DICOMimages" ("SeriesInst")'
-        self.execute_db_query(index_dicomimages)
-        self.execute_db_query(index_dicomseries)
-        self.execute_db_query(index_dicomimages_seriesinst)
-        log.info('Created index_dicomimages and index_dicomseries')
+    def __drop_secondary_indexes(self):
+        """Drops the non unique indexes, the unique indexes stay because INSERT OR IGNORE relies on them"""
+        for indexname in self.__secondary_indexes:
+            self.execute_db_query('DROP INDEX IF EXISTS "{}"'.format(indexname))
 
     def database_postprocessing(self):
         """
@@ -1145,7 +2216,7 @@ class pyconquest:
             for uid in uidlist:
                 q = query.format(uid)
                 result = self.execute_db_query(q)
-                filelist = ['{}\{}'.format(self.data_directory, d['ObjectFile']) for d in result]
+                filelist = [os.path.join(self.data_directory, d['ObjectFile']) for d in result]
                 returnlist = returnlist + filelist
             return returnlist
 
@@ -1186,7 +2257,7 @@ class pyconquest:
 
         try:
             ds = dcmread(filename)
-            dicomtype = ds[0x0008, 0x0060].value
+            dicomtype = ds[_TAG_MODALITY].value
             if dicomtype == 'RTSTRUCT':
                 contours = ds[0x3006, 0x0020].value
                 roicounter = 0
@@ -1233,7 +2304,7 @@ class pyconquest:
 
     def __set_default_database(self):
         log.info('Using default database layout,specify .sql file during instance creation to change this')
-        self.__db_design = \
+        db_design = \
             {'DICOMpatients':
                  [['0x0010', '0x0020', 'PatientID'],
                   ['0x0010', '0x0010', 'PatientNam'],
@@ -1345,3 +2416,6 @@ class pyconquest:
                   ['0x0040', '0x0100', '---------'],
                   ['0x0040', '0x1001', 'ReqProcID'],
                   ['0x0040', '0x1003', 'ReqProcPri']]}
+        self.__db_design = {tablename: [self.__resolve_column(col) for col in tablelist]
+                            for tablename, tablelist in db_design.items()}
+        self.__specific_tags = None